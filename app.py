@@ -1,4 +1,5 @@
-from script_generation import initialize_gemini, generate_xml, load_icon_mappings
+from script_generation import initialize_gemini, generate_xml, generate_provider_variants, load_icon_mappings, save_to_history
+from history_index import find_similar_diagram, history_mode, load_history_xml, prepare_few_shot_hint, warm_history_index, REUSE_THRESHOLD
 import time
 # import os
 import streamlit as st
@@ -7,6 +8,8 @@ import streamlit as st
 # Initialize session state variables
 if "generated_xmls" not in st.session_state:
     st.session_state["generated_xmls"] = []
+if "saved_history_ids" not in st.session_state:
+    st.session_state["saved_history_ids"] = set()
 
 # def display_diagram(xml_data: str):
 #     """
@@ -82,6 +85,9 @@ def main():
      # Load icon mappings
     azure_icons, gcp_icons, aws_icons = load_icon_mappings()
 
+    # Load the diagram history index in the background while the user types
+    warm_history_index()
+
     # Main input area
     input_text = st.text_area(
         "Enter diagram description:",
@@ -96,9 +102,41 @@ def main():
         help="Provide a custom name for the generated XML file"
     )
 
+    use_icon_codes = st.checkbox(
+        "Use short icon codes",
+        value=False,
+        help="Have the model emit compact icon codes (e.g. aws:amazon-ec2-64) that are expanded to full URLs after generation"
+    )
+
+    generate_variants = st.checkbox(
+        "Generate AWS, Azure and GCP variants",
+        value=False,
+        help="Draw the same architecture for each provider concurrently, one page per provider"
+    )
+
     if custom_file_name.strip():
         custom_file_name += ".drawio.xml"
 
+    # Look for a similar past diagram generated the same way before generating a new one,
+    # skipping diagrams this session saved itself
+    mode = history_mode(generate_variants, use_icon_codes)
+    similar_diagram = find_similar_diagram(input_text, mode, st.session_state["saved_history_ids"]) if input_text else None
+    few_shot_hint = ""
+    if similar_diagram:
+        similarity, record = similar_diagram
+        if similarity >= REUSE_THRESHOLD:
+            existing_xml = load_history_xml(record)
+            if existing_xml:
+                st.info(f"A very similar diagram already exists ({similarity:.0%} match): {record['description']}")
+                st.download_button(
+                    label="Download existing diagram",
+                    data=existing_xml,
+                    file_name=custom_file_name,
+                    mime="application/xml",
+                    help="Reuse the previously generated diagram instead of generating a new one"
+                )
+        few_shot_hint = prepare_few_shot_hint(record)
+
     col1, col2 = st.columns([1, 2])
 
     with col1:
@@ -112,7 +150,10 @@ def main():
                         time.sleep(0.01)
                         progress_bar.progress(i + 1)
 
-                    xml_data = generate_xml(input_text, model, azure_icons, gcp_icons, aws_icons)
+                    if generate_variants:
+                        xml_data = generate_provider_variants(input_text, model, azure_icons, gcp_icons, aws_icons, use_icon_codes=use_icon_codes)
+                    else:
+                        xml_data = generate_xml(input_text, model, azure_icons, gcp_icons, aws_icons, use_icon_codes=use_icon_codes, few_shot_hint=few_shot_hint)
 
                     if xml_data:
                         # Validate XML structure
@@ -121,6 +162,9 @@ def main():
                             return
 
                         st.success("Diagram generated successfully!")
+                        history_id = save_to_history(xml_data, input_text, mode)
+                        if history_id:
+                            st.session_state["saved_history_ids"].add(history_id)
 
                         # # Display the Open in Draw.io button
                         # st.subheader("Diagram Generated:")
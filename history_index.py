@@ -0,0 +1,378 @@
+import streamlit as st
+import logging
+import os
+import json
+import re
+import random
+import hashlib
+import threading
+import uuid
+from array import array
+from collections import Counter
+import xml.etree.ElementTree as ET
+from xml.etree.ElementTree import ParseError
+from typing import Optional, Tuple, List, Set
+
+logger = logging.getLogger(__name__)
+
+# On-disk layout: one JSON line per generation plus the XML in its own file.
+# Signatures are stored as hex strings of 16-bit MinHash values to keep lines small.
+HISTORY_DIR = "history"
+INDEX_FILE = os.path.join(HISTORY_DIR, "diagram_index.jsonl")
+XML_DIR = os.path.join(HISTORY_DIR, "diagrams")
+
+# MinHash signature split into LSH bands for nearest-neighbour lookup
+NUM_BANDS = 24
+ROWS_PER_BAND = 3
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+MERSENNE_PRIME = (1 << 61) - 1
+SIGNATURE_MASK = 0xFFFF
+
+# Only the candidates sharing the most bands with the query are scored, which keeps
+# lookups fast when descriptions share a common cloud vocabulary
+MAX_CANDIDATES = 100
+
+# Similarity above which a past diagram is offered as-is, and below which it is ignored
+REUSE_THRESHOLD = 0.9
+FEW_SHOT_THRESHOLD = 0.3
+
+STOPWORDS = {
+    "to", "on", "in", "of", "an", "as", "by", "is", "it", "or", "at", "be", "we",
+    "the", "and", "for", "with", "from", "into", "that", "this", "which", "are",
+    "use", "using", "then", "its", "their", "via", "each", "all", "will", "should"
+}
+
+_rng = random.Random(20240101)
+_PERMUTATIONS = [
+    (_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+_index_lock = threading.Lock()
+_warm_thread = None
+
+def tokenize_description(description: str) -> List[str]:
+    """
+    Split a description into word unigrams and bigrams, dropping stopwords.
+    Two-letter words are kept since many service names are short (s3, vm, db, ad).
+    """
+    words = [
+        word for word in re.findall(r"[a-z0-9]+", description.lower())
+        if len(word) > 1 and word not in STOPWORDS
+    ]
+    bigrams = [f"{first} {second}" for first, second in zip(words, words[1:])]
+    return words + bigrams
+
+def compute_signature(description: str) -> array:
+    """
+    Compute the 16-bit MinHash signature of a description.
+    Returns an empty signature when the description has no usable tokens.
+    """
+    token_hashes = {
+        int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+        for token in tokenize_description(description)
+    }
+    if not token_hashes:
+        return array("H")
+
+    return array("H", (
+        min((a * token_hash + b) % MERSENNE_PRIME for token_hash in token_hashes) & SIGNATURE_MASK
+        for a, b in _PERMUTATIONS
+    ))
+
+def encode_signature(signature: array) -> str:
+    """
+    Encode a signature as a hex string for the index file.
+    """
+    return signature.tobytes().hex()
+
+def decode_signature(encoded: str) -> array:
+    """
+    Decode a signature written by encode_signature. Malformed values decode to an empty signature.
+    """
+    signature = array("H")
+    try:
+        signature.frombytes(bytes.fromhex(encoded))
+    except (TypeError, ValueError):
+        return array("H")
+    return signature
+
+def estimate_similarity(signature_a: array, signature_b: array) -> float:
+    """
+    Estimate the Jaccard similarity of two descriptions from their signatures.
+    """
+    if not signature_a or not signature_b:
+        return 0.0
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return matches / NUM_PERM
+
+def band_keys(signature: array) -> List[int]:
+    """
+    Split a signature into its LSH band keys, each packed into a single int.
+    """
+    signature_bytes = signature.tobytes()
+    band_size = ROWS_PER_BAND * signature.itemsize
+    return [
+        int.from_bytes(signature_bytes[band * band_size:(band + 1) * band_size], "little")
+        for band in range(NUM_BANDS)
+    ]
+
+def extract_diagram_graph(xml_string: str) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """
+    Extract component labels and labelled edges from a generated Draw.io XML.
+    """
+    try:
+        root = ET.fromstring(xml_string.encode("utf-8"))
+    except ParseError as e:
+        logger.error(f"XML Parsing Error while indexing diagram: {e}")
+        return [], []
+
+    # Cell ids are only unique within a page, so labels are resolved per diagram page
+    pages = list(root.iter("diagram")) or [root]
+
+    components = []
+    edges = []
+    for page in pages:
+        labels = {}
+        for cell in page.iter("mxCell"):
+            if cell.get("vertex") != "1":
+                continue
+            label = re.sub(r"<[^>]+>", " ", cell.get("value", ""))
+            label = " ".join(label.split())
+            if not label:
+                continue
+            labels[cell.get("id")] = label
+            if label not in components:
+                components.append(label)
+
+        for cell in page.iter("mxCell"):
+            if cell.get("edge") != "1":
+                continue
+            source = labels.get(cell.get("source"))
+            target = labels.get(cell.get("target"))
+            if source and target and (source, target) not in edges:
+                edges.append((source, target))
+
+    return components, edges
+
+def history_mode(variants: bool, icon_codes: bool) -> str:
+    """
+    Describe how a diagram was generated, e.g. 'variants+icon_codes'.
+    Only diagrams generated the same way are offered for reuse.
+    """
+    mode = "variants" if variants else "single"
+    if icon_codes:
+        mode += "+icon_codes"
+    return mode
+
+def _bucket_key(mode_number: int, band: int, band_key: int) -> int:
+    """
+    Pack a mode, band number and band key into a single bucket key.
+    """
+    return ((mode_number * NUM_BANDS + band) << (ROWS_PER_BAND * 16)) | band_key
+
+def _new_index(index_file: str) -> dict:
+    # Only what lookups need is kept in memory; full records are read back from
+    # their line in the index file on a match
+    return {
+        "file": index_file,
+        "ids": [],
+        "offsets": array("Q"),
+        "signatures": array("H"),
+        "modes": {},
+        "buckets": {}
+    }
+
+def _add_record(index: dict, record_id: str, mode: str, signature: array, offset: int):
+    if len(signature) != NUM_PERM:
+        return
+    position = len(index["ids"])
+    index["ids"].append(record_id)
+    index["offsets"].append(offset)
+    index["signatures"].extend(signature)
+
+    mode_number = index["modes"].setdefault(mode, len(index["modes"]))
+    buckets = index["buckets"]
+    for band, band_key in enumerate(band_keys(signature)):
+        key = _bucket_key(mode_number, band, band_key)
+        # Most buckets hold a single record, which is stored without a list
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = position
+        elif isinstance(bucket, int):
+            buckets[key] = [bucket, position]
+        else:
+            bucket.append(position)
+
+def _record_signature(index: dict, position: int) -> array:
+    return index["signatures"][position * NUM_PERM:(position + 1) * NUM_PERM]
+
+def _read_record(index_file: str, offset: int) -> dict:
+    with open(index_file, 'rb') as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+@st.cache_resource
+def load_history_index(index_file: str = INDEX_FILE) -> dict:
+    """
+    Load the diagram history index from disk once per server process.
+    """
+    index = _new_index(index_file)
+
+    if not os.path.exists(index_file):
+        return index
+
+    try:
+        with open(index_file, 'rb') as f:
+            offset = 0
+            for line_number, line in enumerate(f, start=1):
+                line_offset = offset
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.warning(f"Skipping corrupt history index line {line_number}: {e}")
+                    continue
+                signature = decode_signature(record.get("signature", ""))
+                if len(signature) != NUM_PERM:
+                    # Written with different MinHash settings
+                    signature = compute_signature(record.get("description", ""))
+                _add_record(index, record["id"], record.get("mode", ""), signature, line_offset)
+
+        logger.info(f"Loaded {len(index['ids'])} diagrams into the history index.")
+    except Exception as e:
+        logger.error(f"Error loading history index: {e}")
+
+    return index
+
+def warm_history_index():
+    """
+    Start loading the history index in the background so the first lookup does not wait for it.
+    Safe to call on every Streamlit rerun; the load is only started once per process.
+    """
+    global _warm_thread
+    with _index_lock:
+        if _warm_thread is None:
+            _warm_thread = threading.Thread(target=load_history_index, daemon=True)
+            _warm_thread.start()
+
+def _candidate_matches(index: dict, mode: str, signature: array) -> List[Tuple[int, int]]:
+    """
+    Return (position, shared band count) pairs for the records in the same mode
+    that share the most LSH bands with a signature.
+    """
+    mode_number = index["modes"].get(mode)
+    if mode_number is None or not signature:
+        return []
+
+    band_matches = Counter()
+    buckets = index["buckets"]
+    for band, band_key in enumerate(band_keys(signature)):
+        bucket = buckets.get(_bucket_key(mode_number, band, band_key))
+        if bucket is None:
+            continue
+        if isinstance(bucket, int):
+            band_matches[bucket] += 1
+        else:
+            band_matches.update(bucket)
+    return band_matches.most_common(MAX_CANDIDATES)
+
+def add_to_history_index(description: str, xml_data: str, mode: str) -> Optional[str]:
+    """
+    Persist a generated diagram and add it to the similarity index.
+    Returns the id of the stored diagram, or of the existing record when one
+    with an identical signature was already indexed in the same mode.
+    """
+    try:
+        signature = compute_signature(description)
+        index = load_history_index()
+
+        for position, shared_bands in _candidate_matches(index, mode, signature):
+            if shared_bands == NUM_BANDS and _record_signature(index, position) == signature:
+                record_id = index["ids"][position]
+                logger.info(f"Diagram already indexed as {record_id}, skipping.")
+                return record_id
+
+        components, edges = extract_diagram_graph(xml_data)
+        record = {
+            "id": uuid.uuid4().hex,
+            "description": description,
+            "mode": mode,
+            "components": components,
+            "edges": edges,
+            "signature": encode_signature(signature)
+        }
+
+        os.makedirs(XML_DIR, exist_ok=True)
+        with open(os.path.join(XML_DIR, f"{record['id']}.xml"), 'w', encoding="utf-8") as f:
+            f.write(xml_data)
+
+        with _index_lock:
+            with open(index["file"], 'ab') as f:
+                offset = f.tell()
+                f.write(json.dumps(record).encode("utf-8") + b"\n")
+            _add_record(index, record["id"], mode, signature, offset)
+
+        return record["id"]
+
+    except Exception as e:
+        logger.error(f"Error adding diagram to history index: {e}")
+        return None
+
+def find_similar_diagram(description: str, mode: str, exclude_ids: Optional[Set[str]] = None) -> Optional[Tuple[float, dict]]:
+    """
+    Find the most similar past diagram generated in the same mode, ignoring
+    exclude_ids (e.g. diagrams saved by the current session).
+    Returns the estimated similarity and the stored record, or None if nothing
+    reaches FEW_SHOT_THRESHOLD.
+    """
+    signature = compute_signature(description)
+    if not signature:
+        return None
+
+    index = load_history_index()
+    exclude_ids = exclude_ids or set()
+
+    best_match = None
+    for position, _ in _candidate_matches(index, mode, signature):
+        if index["ids"][position] in exclude_ids:
+            continue
+        similarity = estimate_similarity(signature, _record_signature(index, position))
+        if best_match is None or similarity > best_match[0]:
+            best_match = (similarity, position)
+
+    if best_match is None or best_match[0] < FEW_SHOT_THRESHOLD:
+        return None
+
+    similarity, position = best_match
+    try:
+        return similarity, _read_record(index["file"], index["offsets"][position])
+    except Exception as e:
+        logger.error(f"Error reading history record {index['ids'][position]}: {e}")
+        return None
+
+def load_history_xml(record: dict) -> Optional[str]:
+    """
+    Read the stored XML of a past diagram.
+    """
+    try:
+        with open(os.path.join(XML_DIR, f"{record['id']}.xml"), 'r', encoding="utf-8") as f:
+            return f.read()
+    except Exception as e:
+        logger.error(f"Error loading stored diagram {record.get('id')}: {e}")
+        return None
+
+def prepare_few_shot_hint(record: dict) -> str:
+    """
+    Build a compact example from a past diagram to guide the next generation.
+    """
+    hint = "\nSIMILAR PAST DIAGRAM (use as a guide, adapt to the new description):\n"
+    hint += f"Description: {record['description']}\n"
+    hint += "Components: " + ", ".join(record["components"]) + "\n"
+    if record["edges"]:
+        hint += "Connections:\n"
+        for source, target in record["edges"]:
+            hint += f"- {source} -> {target}\n"
+    return hint
@@ -4,12 +4,17 @@ import logging
 import configparser
 import toml
 import os
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, Tuple, List
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
 import json
 import re
 import xml.etree.ElementTree as ET
 from xml.etree.ElementTree import fromstring, ParseError    
+from xml.sax.saxutils import escape
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from history_index import add_to_history_index
 
 # Set up logging 
 logging.basicConfig(
@@ -60,6 +65,25 @@ def load_icon_mappings() -> Tuple[Dict[str, str], Dict[str, str], Dict[str, str]
         st.error(f"Failed to load icon mappings: {e}")
         return {}, {}, {}
 
+def load_service_equivalents() -> List[Dict[str, str]]:
+    """
+    Load the cross-provider service equivalence table (e.g. S3 / Blob Storage / Cloud Storage).
+    Each entry maps a provider name to its equivalent service name.
+    """
+    try:
+        with open("resources/service_equivalents.json", 'r') as f:
+            equivalents = json.load(f)
+
+        if not isinstance(equivalents, list):
+            raise ValueError("Service equivalents must be a list.")
+
+        return equivalents
+
+    except Exception as e:
+        logger.error(f"Error loading service equivalents: {e}")
+        st.error(f"Failed to load service equivalents: {e}")
+        return []
+
 def get_icon_url(provider: str, resource_name: str, icon_mappings: Dict[str, Dict[str, str]]) -> str:
     """
     Retrieve the icon URL for a given resource and provider. 
@@ -239,15 +263,17 @@ def initialize_gemini() -> Optional[genai.GenerativeModel]:
         st.error(f"Gemini initialization error: {str(e)}")
         return None
 
-def save_to_history(xml_data: str, description: str):
+def save_to_history(xml_data: str, description: str, mode: str) -> Optional[str]:
     """
-    Save generated XML to history.
+    Save generated XML to history and to the on-disk similarity index.
+    Returns the id of the indexed diagram.
     """
     st.session_state.generated_xmls.append({
         "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
         "description": description,
         "xml": xml_data
     })
+    return add_to_history_index(description, xml_data, mode)
 
 def prepare_icon_reference(aws_icons, azure_icons, gcp_icons):
     icon_reference = "\nPRECISE ICON URLS:\n"
@@ -260,10 +286,111 @@ def prepare_icon_reference(aws_icons, azure_icons, gcp_icons):
     
     return icon_reference
 
+def make_icon_code(provider: str, icon_name: str) -> str:
+    """
+    Build a short, stable icon code such as 'aws:amazon-ec2-64' from a mapping key.
+    """
+    prefix = provider.lower()
+    name = re.sub(rf'^{prefix}\s+', '', icon_name.lower())
+    slug = re.sub(r'[^a-z0-9]+', '-', name).strip('-')
+    return f"{prefix}:{slug}"
 
-def generate_xml(description: str, model: genai.GenerativeModel, azure_icons: Dict[str, str], gcp_icons: Dict[str, str], aws_icons: Dict[str, str]) -> Optional[str]:
+def build_icon_codes(azure_icons: Dict[str, str], gcp_icons: Dict[str, str], aws_icons: Dict[str, str]) -> Dict[str, str]:
+    """
+    Map short icon codes to their full icon URLs for every provider.
+    """
+    icon_codes = {}
+    for provider, icons in [('AWS', aws_icons), ('Azure', azure_icons), ('GCP', gcp_icons)]:
+        for icon_name, icon_urls in icons.items():
+            code = make_icon_code(provider, icon_name)
+            # Keep codes unique if two names collapse to the same slug
+            suffix = 2
+            unique_code = code
+            while unique_code in icon_codes:
+                unique_code = f"{code}-{suffix}"
+                suffix += 1
+            icon_codes[unique_code] = icon_urls[0] if isinstance(icon_urls, list) else icon_urls
+    return icon_codes
+
+def prepare_icon_code_reference(icon_codes: Dict[str, str]) -> str:
+    """
+    List the available icon codes, one per line, for the prompt.
+    """
+    return "\nICON CODES:\n" + "\n".join(icon_codes) + "\n"
+
+def expand_icon_codes(generated_xml: str, icon_codes: Dict[str, str]) -> Tuple[str, List[str]]:
+    """
+    Replace icon codes in style attributes with full icon URLs in a single pass.
+    Returns the expanded XML and the list of codes that were not recognised.
+    """
+    unknown_codes = []
+
+    def expand(match):
+        code = match.group(1).lower()
+        if code in icon_codes:
+            # URLs may contain characters such as & that must be escaped inside an attribute
+            return f"image={escape(icon_codes[code])}"
+        if code not in unknown_codes:
+            unknown_codes.append(code)
+        return match.group(0)
+
+    expanded_xml = re.sub(
+        r'image=((?:aws|azure|gcp):[A-Za-z0-9._-]+)',
+        expand,
+        generated_xml,
+        flags=re.IGNORECASE
+    )
+    return expanded_xml, unknown_codes
+
+
+def generate_xml(description: str, model: genai.GenerativeModel, azure_icons: Dict[str, str], gcp_icons: Dict[str, str], aws_icons: Dict[str, str], use_icon_codes: bool = False, few_shot_hint: str = "", provider: Optional[str] = None, provider_instructions: str = "") -> Optional[str]:
     max_attempts = 3
     icon_reference_list = prepare_icon_reference(aws_icons, azure_icons, gcp_icons)
+
+    if use_icon_codes:
+        # The model emits short codes which are expanded to full URLs after generation
+        icon_codes = build_icon_codes(azure_icons, gcp_icons, aws_icons)
+        icon_placeholders = {"AWS": "AWS_ICON_CODE", "Azure": "AZURE_ICON_CODE", "GCP": "GCP_ICON_CODE"}
+        icon_instructions = f"""CRITICAL ICON USAGE REQUIREMENTS:
+                1. ALWAYS use an icon CODE from the list below in the style attribute, never a URL
+                2. Format the style attribute EXACTLY like this:
+                style="shape=image;aspect=fixed;image=ICON_CODE;"
+
+                ICON PLACEMENT EXAMPLE:
+                - For AWS EC2:
+                style="shape=image;aspect=fixed;image=aws:amazon-ec2-64;"
+
+                AVAILABLE ICONS:
+                {prepare_icon_code_reference(icon_codes)}
+
+                Description: {description}
+
+                GENERATE THE DIAGRAM WITH EXACT ICON CODE MATCHING!"""
+    else:
+        icon_placeholders = {"AWS": "PATH_TO_AWS_ICON", "Azure": "PATH_TO_AZURE_ICON", "GCP": "PATH_TO_GCP_ICON"}
+        icon_instructions = f"""CRITICAL ICON USAGE REQUIREMENTS:
+                1. ALWAYS include the FULL icon URL in the style attribute
+                2. Format the style attribute EXACTLY like this:
+                style="shape=image;aspect=fixed;image=FULL_ICON_URL;"
+
+                ICON PLACEMENT EXAMPLE:
+                - For AWS EC2: 
+                style="shape=image;aspect=fixed;image=https://raw.githubusercontent.com/SuryaNeoware/cloud_icons/main/icon_set/aws_icons/Res_Amazon-EC2_Im4gn-Instance_48_Light.svg;"
+
+                AVAILABLE ICONS:
+                {aws_icons, azure_icons, gcp_icons}
+
+                Description: {description}
+
+                GENERATE THE DIAGRAM WITH EXACT ICON URL MATCHING!"""
+
+    # A single-provider variant only gets the style line for its own provider
+    style_providers = [provider] if provider else ["AWS", "Azure", "GCP"]
+    icon_style_lines = "\n            ".join(
+        f"* For {style_provider} services, use style='shape=image;aspect=fixed;image={icon_placeholders[style_provider]};verticalLabelPosition=bottom;verticalAlign=top;align=center;'"
+        for style_provider in style_providers
+    )
+
     for attempt in range(max_attempts):
         try:
             full_prompt = f"""Generate a complete, valid Draw.io XML diagram based on this description:
@@ -277,9 +404,7 @@ def generate_xml(description: str, model: genai.GenerativeModel, azure_icons: Di
             - Do NOT include code block markers (```xml)
             - Use valid mxGeometry tag formatting
             - When adding cloud service icons, use specific icon styles:
-            * For AWS services, use style='shape=image;aspect=fixed;image=PATH_TO_AWS_ICON;verticalLabelPosition=bottom;verticalAlign=top;align=center;'
-            * For Azure services, use style='shape=image;aspect=fixed;image=PATH_TO_AZURE_ICON;verticalLabelPosition=bottom;verticalAlign=top;align=center;'
-            * For GCP services, use style='shape=image;aspect=fixed;image=PATH_TO_GCP_ICON;verticalLabelPosition=bottom;verticalAlign=top;align=center;'
+            {icon_style_lines}
             * For other components use generic shapes with appropriate labels.
 
             FORMATTING REQUIREMENTS:
@@ -289,21 +414,9 @@ def generate_xml(description: str, model: genai.GenerativeModel, azure_icons: Di
 
             You are an expert at generating Draw.io XML diagrams with precise icon usage.
 
-                CRITICAL ICON USAGE REQUIREMENTS:
-                1. ALWAYS include the FULL icon URL in the style attribute
-                2. Format the style attribute EXACTLY like this:
-                style="shape=image;aspect=fixed;image=FULL_ICON_URL;"
-
-                ICON PLACEMENT EXAMPLE:
-                - For AWS EC2: 
-                style="shape=image;aspect=fixed;image=https://raw.githubusercontent.com/SuryaNeoware/cloud_icons/main/icon_set/aws_icons/Res_Amazon-EC2_Im4gn-Instance_48_Light.svg;"
-
-                AVAILABLE ICONS:
-                {aws_icons, azure_icons, gcp_icons}
-
-                Description: {description}
-
-                GENERATE THE DIAGRAM WITH EXACT ICON URL MATCHING!
+                {icon_instructions}
+                {provider_instructions}
+                {few_shot_hint}
             """
             
             logger.info(f"Attempt {attempt + 1}: Sending prompt to Gemini API.")
@@ -311,12 +424,20 @@ def generate_xml(description: str, model: genai.GenerativeModel, azure_icons: Di
             
             if response.parts:
                 xml_string = response.parts[0].text
+
+                unknown_codes = []
+                if use_icon_codes:
+                    xml_string, unknown_codes = expand_icon_codes(xml_string, icon_codes)
                 
                 # Preprocess and validate XML
                 xml_string = preprocess_xml(xml_string)
                 
                 if validate_xml(xml_string):
                     logger.info("Successfully generated valid XML.")
+                    # Only report unknown codes for the attempt that is returned
+                    if unknown_codes:
+                        logger.warning(f"Unknown icon codes: {unknown_codes}")
+                        st.warning(f"Unknown icon codes left unexpanded: {', '.join(unknown_codes)}")
                     return xml_string
                 else:
                     logger.warning("Generated XML failed validation")
@@ -331,6 +452,101 @@ def generate_xml(description: str, model: genai.GenerativeModel, azure_icons: Di
 
 
 
+def prepare_variant_instructions(provider: str, equivalents: List[Dict[str, str]]) -> str:
+    """
+    Build the instructions that restrict a variant to a single provider's services.
+    """
+    mapping_lines = []
+    for entry in equivalents:
+        target = entry.get(provider)
+        if not target:
+            continue
+        others = [name for other, name in entry.items() if other != provider and name != target]
+        if others:
+            mapping_lines.append(f"- {' / '.join(others)} -> {provider} {target}")
+
+    variant_instructions = f"""Draw this architecture using ONLY {provider} services and {provider} icons.
+                Replace services from other providers with their {provider} equivalents:
+                """ + "\n                ".join(mapping_lines)
+    return variant_instructions
+
+def merge_xml_pages(xml_pages: List[Tuple[str, str]]) -> Optional[str]:
+    """
+    Combine several generated diagrams into one mxfile with a named page per diagram.
+    """
+    mxfile = ET.Element("mxfile", {
+        "host": "app.diagrams.net",
+        "modified": "2024-01-01T00:00:00.000Z",
+        "agent": "Cloud Diagram Generator",
+        "version": "21.6.0"
+    })
+
+    for page_name, xml_string in xml_pages:
+        try:
+            root = ET.fromstring(xml_string.encode('utf-8'))
+        except ParseError as e:
+            logger.error(f"Skipping {page_name} page, XML Parsing Error: {e}")
+            continue
+
+        if root.tag == "diagram":
+            diagrams = [root]
+        elif root.tag == "mxGraphModel":
+            diagram = ET.Element("diagram")
+            diagram.append(root)
+            diagrams = [diagram]
+        else:
+            diagrams = root.findall("diagram")
+
+        for index, diagram in enumerate(diagrams):
+            diagram.set("name", page_name if index == 0 else f"{page_name} {index + 1}")
+            diagram.set("id", f"{page_name.lower()}-{index + 1}")
+            mxfile.append(diagram)
+
+    if not len(mxfile):
+        return None
+
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(mxfile, encoding="unicode")
+
+def generate_provider_variants(description: str, model: genai.GenerativeModel, azure_icons: Dict[str, str], gcp_icons: Dict[str, str], aws_icons: Dict[str, str], use_icon_codes: bool = False) -> Optional[str]:
+    """
+    Generate AWS, Azure and GCP versions of one description concurrently.
+    Each variant only sees its own provider's icons; the results are returned
+    as separate pages of a single mxfile. No few-shot hint is passed, since a past
+    diagram's components would contradict the single-provider instruction.
+    """
+    equivalents = load_service_equivalents()
+    provider_icons = {
+        "AWS": ({}, {}, aws_icons),
+        "Azure": (azure_icons, {}, {}),
+        "GCP": ({}, gcp_icons, {})
+    }
+
+    # Worker threads need the script context so st.* calls reach the page
+    script_ctx = get_script_run_ctx()
+
+    def generate_variant(provider: str) -> Optional[str]:
+        add_script_run_ctx(threading.current_thread(), script_ctx)
+        variant_instructions = prepare_variant_instructions(provider, equivalents)
+        variant_azure, variant_gcp, variant_aws = provider_icons[provider]
+        return generate_xml(description, model, variant_azure, variant_gcp, variant_aws, use_icon_codes=use_icon_codes, provider=provider, provider_instructions=variant_instructions)
+
+    with ThreadPoolExecutor(max_workers=len(provider_icons)) as executor:
+        results = list(executor.map(generate_variant, provider_icons))
+
+    xml_pages = []
+    for provider, xml_string in zip(provider_icons, results):
+        if xml_string:
+            xml_pages.append((provider, xml_string))
+        else:
+            logger.warning(f"No {provider} variant was generated")
+
+    if not xml_pages:
+        logger.error("Failed to generate any provider variant.")
+        return None
+
+    return merge_xml_pages(xml_pages)
+
+
 def replace_icon_urls(generated_xml: str, icon_mappings: Dict[str, Dict[str, str]]) -> str:
     """
     Precisely replace icon URLs with exact matches from mappings